@@ -1,13 +1,18 @@
 # Copyright (c) Microsoft. All rights reserved.
 
 import asyncio
+import functools
+import hashlib
 import logging
-from typing import Annotated, Any, Literal
+import string
+from dataclasses import dataclass, field
+from typing import Annotated, Any, AsyncIterator, Iterator, Literal
 
-from azure.ai.contentsafety import ContentSafetyClient
-from azure.ai.contentsafety.models import AnalyzeTextOptions
+from azure.ai.contentsafety.aio import ContentSafetyClient
+from azure.ai.contentsafety.models import AnalyzeTextOptions, AnalyzeTextOutputType
 from azure.core.credentials import AzureKeyCredential
-from azure.identity import DefaultAzureCredential
+from azure.core.pipeline.policies import AsyncRetryPolicy
+from azure.identity.aio import DefaultAzureCredential
 from pydantic import BaseModel, ConfigDict, Field
 from semantic_workbench_assistant import config
 from semantic_workbench_assistant.assistant_app import (
@@ -54,6 +59,33 @@ class AzureContentSafetyEvaluatorConfigModel(BaseModel):
         ),
     ] = 4
 
+    categories: Annotated[
+        list[Literal["Hate", "SelfHarm", "Sexual", "Violence"]],
+        Field(
+            title="Categories",
+            description=(
+                "The harm categories to evaluate. Only the selected categories are analyzed by the service, so"
+                " narrowing the selection reduces the work done per request."
+            ),
+            min_length=1,
+            json_schema_extra={"uniqueItems": True},
+        ),
+        UISchema(widget="checkboxes"),
+    ] = ["Hate", "SelfHarm", "Sexual", "Violence"]
+
+    min_evaluable_length: Annotated[
+        int,
+        Field(
+            title="Minimum Evaluable Length",
+            description=(
+                "The minimum number of characters, ignoring whitespace and punctuation, for content to be sent to the"
+                " Azure Content Safety service. Shorter content passes without a request. Set to 0 to evaluate all"
+                " content."
+            ),
+            ge=0,
+        ),
+    ] = 3
+
     max_request_length: Annotated[
         int,
         Field(
@@ -63,9 +95,47 @@ class AzureContentSafetyEvaluatorConfigModel(BaseModel):
                 " or equal to the service's maximum (10,000 characters at the time of writing). The evaluator will"
                 " split and send the content in batches if it exceeds this length."
             ),
+            ge=1,
         ),
     ] = 10000
 
+    max_concurrent_requests: Annotated[
+        int,
+        Field(
+            title="Maximum Concurrent Requests",
+            description=(
+                "The maximum number of requests to send to the Azure Content Safety service at the same time, shared"
+                " by all evaluations against the same endpoint and auth method that use the same limit. Evaluations"
+                " configured with different limits are limited separately, so keep the combined limits within your"
+                " resource's rate limit to avoid throttled requests."
+            ),
+            ge=1,
+        ),
+    ] = 8
+
+    request_timeout: Annotated[
+        float,
+        Field(
+            title="Request Timeout",
+            description=(
+                "The connection and read timeout, in seconds, for each request to the Azure Content Safety service."
+                " Timed out requests are retried with backoff, along with throttled and unavailable responses."
+            ),
+            gt=0,
+        ),
+    ] = 10
+
+    include_raw_response: Annotated[
+        bool,
+        Field(
+            title="Include Raw Response",
+            description=(
+                "Include the full Azure Content Safety service response in the evaluation metadata, for auditing."
+                " When disabled, only the category severities are included."
+            ),
+        ),
+    ] = False
+
 
 # endregion
 
@@ -101,6 +171,13 @@ class AzureContentSafetyServiceKeyAuthConfig(BaseModel):
     ] = ""
 
 
+# a single credential is shared by all clients, as constructing it probes each of the supported credential
+# sources, and sharing it allows acquired tokens to be re-used
+@functools.lru_cache(maxsize=1)
+def _default_credential() -> DefaultAzureCredential:
+    return DefaultAzureCredential()
+
+
 class AzureContentSafetyServiceConfigModel(BaseModel):
     auth_config: Annotated[
         AzureContentSafetyServiceIdentityAuthConfig | AzureContentSafetyServiceKeyAuthConfig,
@@ -119,14 +196,91 @@ class AzureContentSafetyServiceConfigModel(BaseModel):
         ),
     ] = config.first_env_var("azure_content_safety_endpoint", "assistant__azure_content_safety_endpoint") or ""
 
-    # set on the class to avoid re-authenticating for each request
     def _get_azure_credentials(self) -> AzureKeyCredential | DefaultAzureCredential:
         match self.auth_config.auth_method:
             case "api-key":
                 return AzureKeyCredential(self.auth_config.azure_content_safety_service_key)
 
             case "azure-identity":
-                return DefaultAzureCredential()
+                return _default_credential()
+
+    def _client_key(self) -> tuple[str, str]:
+        return (self.azure_content_safety_endpoint, self.auth_config.auth_method)
+
+    def _credential_digest(self) -> str:
+        # a digest of the api key identifies the credential, so that the client cache does not hold the key itself
+        match self.auth_config.auth_method:
+            case "api-key":
+                return hashlib.sha256(self.auth_config.azure_content_safety_service_key.encode()).hexdigest()
+
+            case "azure-identity":
+                return ""
+
+
+# clients are cached at the module level, keyed by endpoint and auth method, as the evaluator is
+# created for each evaluation; this allows the connection pool and credential tokens to be re-used.
+# only the client for the current credential is kept, so a rotated key replaces and closes the old client
+_clients: dict[tuple[str, str], tuple[str, ContentSafetyClient]] = {}
+
+# references to the tasks closing replaced clients, so they are not garbage collected before completing
+_closing_tasks: set[asyncio.Task[None]] = set()
+
+
+def _get_client(config_secrets: AzureContentSafetyServiceConfigModel) -> ContentSafetyClient:
+    key = config_secrets._client_key()
+    credential_digest = config_secrets._credential_digest()
+    entry = _clients.get(key)
+    if entry is not None and entry[0] == credential_digest:
+        return entry[1]
+
+    client = ContentSafetyClient(
+        endpoint=config_secrets.azure_content_safety_endpoint,
+        credential=config_secrets._get_azure_credentials(),
+        # retry up to 5 times with a 0.5 backoff factor on the default retryable statuses (including 429
+        # and 503); analyze_text calls also make their POST requests retryable and set per-call timeouts
+        retry_policy=AsyncRetryPolicy(
+            retry_total=5,
+            retry_backoff_factor=0.5,
+        ),
+    )
+    _clients[key] = (credential_digest, client)
+
+    if entry is not None:
+        _close_client(entry[1])
+
+    return client
+
+
+def _close_client(client: ContentSafetyClient) -> None:
+    """
+    Close a replaced client in the background, releasing its connection pool and credential.
+    """
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # without a running loop the client cannot be closed here, and is released when garbage collected
+        return
+
+    task = loop.create_task(client.close())
+    _closing_tasks.add(task)
+    task.add_done_callback(_closing_tasks.discard)
+
+
+# request semaphores are cached alongside the clients, keyed by endpoint, auth method and limit, so the
+# concurrency limit applies across all of the evaluations against a resource that use the same limit rather
+# than to each evaluation; a semaphore is never replaced while evaluations may be waiting on it
+_request_semaphores: dict[tuple[str, str, int], asyncio.Semaphore] = {}
+
+
+def _get_request_semaphore(
+    config_secrets: AzureContentSafetyServiceConfigModel, max_concurrent_requests: int
+) -> asyncio.Semaphore:
+    key = (*config_secrets._client_key(), max_concurrent_requests)
+    semaphore = _request_semaphores.get(key)
+    if semaphore is None:
+        semaphore = _request_semaphores[key] = asyncio.Semaphore(max_concurrent_requests)
+    return semaphore
 
 
 # endregion
@@ -137,6 +291,18 @@ class AzureContentSafetyServiceConfigModel(BaseModel):
 #
 
 
+@dataclass(slots=True)
+class _BatchResult:
+    """
+    The result of evaluating a single batch, kept as a plain dataclass while the result is being determined and
+    combined; the overall result is returned as a ContentSafetyEvaluation.
+    """
+
+    result: ContentSafetyEvaluationResult
+    note: str | None = None
+    metadata: dict[str, Any] = field(default_factory=dict)
+
+
 class AzureContentSafetyEvaluator(ContentSafetyEvaluator):
     """
     An evaluator that uses the Azure Content Safety service to evaluate content safety.
@@ -147,109 +313,318 @@ class AzureContentSafetyEvaluator(ContentSafetyEvaluator):
     ) -> None:
         self.config = config
         self.config_secrets = config_secrets
+        self._client = _get_client(config_secrets)
+        self._request_semaphore = _get_request_semaphore(config_secrets, config.max_concurrent_requests)
 
     async def evaluate(self, content: str | list[str]) -> ContentSafetyEvaluation:
         """
         Evaluate the content for safety using the Azure Content Safety service.
         """
 
-        # if the content is a list, join it into a single string
-        text = content if isinstance(content, str) else "\n".join(content)
+        # content that fits in a single request, the common case for a single message, is evaluated directly
+        # rather than through batching and streaming; blank content is left to batching, which skips it
+        if (
+            isinstance(content, str)
+            and len(content) <= self.config.max_request_length
+            and content.strip()
+            and not _is_below_evaluable_length([content], self.config.min_evaluable_length)
+        ):
+            batch_result = await self._evaluate_batch(content)
+            return ContentSafetyEvaluation(
+                result=batch_result.result,
+                note=batch_result.note,
+                metadata={
+                    "content_length": len(content),
+                    "max_request_length": self.config.max_request_length,
+                    "batches": [batch_result.metadata],
+                },
+            )
+
+        # the last evaluation from the stream is the overall evaluation
+        evaluation = ContentSafetyEvaluation()
+        async for evaluation in self.evaluate_streaming(content):
+            pass
+
+        return evaluation
 
-        # batch the content into items that are within the maximum length
-        if len(text) > self.config.max_request_length:
-            items = [
-                text[i : i + self.config.max_request_length]  # noqa: E203
-                for i in range(0, len(text), self.config.max_request_length)
-            ]
-        else:
-            items = [text]
+    async def evaluate_streaming(self, content: str | list[str]) -> AsyncIterator[ContentSafetyEvaluation]:
+        """
+        Evaluate the content for safety using the Azure Content Safety service, yielding an interim evaluation
+        as soon as any batch warns or fails, followed by the overall evaluation. After a batch fails, the
+        remaining batches are cancelled.
+        """
+        # if the content is a list, it is evaluated as if joined by newlines, without building the joined string
+        content_list = [content] if isinstance(content, str) else content
 
         # initialize the result as pass
         result = ContentSafetyEvaluationResult.Pass
         note: str | None = None
 
+        content_length = sum(map(len, content_list)) + max(len(content_list) - 1, 0)
+
+        # content that is too short to carry unsafe content passes without a request to the service
+        if _is_below_evaluable_length(content_list, self.config.min_evaluable_length):
+            logger.debug("skipping content safety evaluation for content below the minimum evaluable length")
+            yield ContentSafetyEvaluation(
+                result=ContentSafetyEvaluationResult.Pass,
+                metadata={
+                    "skipped": "below_min_length",
+                    "content_length": content_length,
+                },
+            )
+            return
+
         metadata: dict[str, Any] = {
-            "content_length": len(text),
+            "content_length": content_length,
             "max_request_length": self.config.max_request_length,
             "batches": [],
         }
 
-        # evaluate each batch of content
-        results = await asyncio.gather(
-            *[self._evaluate_batch(batch) for batch in items],
-        )
+        # evaluate each batch of content concurrently, where each batch is within the maximum length, and
+        # identical batches (such as repeated messages) share a single evaluation
+        unique_tasks: dict[str, asyncio.Task[_BatchResult]] = {}
+        tasks: list[asyncio.Task[_BatchResult]] = []
+        for batch in _batch_content(content_list, self.config.max_request_length):
+            task = unique_tasks.get(batch)
+            if task is None:
+                task = unique_tasks[batch] = asyncio.create_task(self._evaluate_batch(batch))
+            tasks.append(task)
+
+        # wait for the batches to complete, cancelling any remaining batches as soon as one fails
+        try:
+            for completed in asyncio.as_completed(unique_tasks.values()):
+                batch_result = await completed
+
+                # if the batch fails, the overall result is a fail, and the remaining batches are cancelled before
+                # the failure is reported, so they stop even if the caller stops reading after the failure
+                failed = batch_result.result == ContentSafetyEvaluationResult.Fail
+                if failed:
+                    result = ContentSafetyEvaluationResult.Fail
+                    note = batch_result.note
+                    for task in unique_tasks.values():
+                        task.cancel()
+
+                # report batches that warn or fail as soon as they complete
+                if batch_result.result != ContentSafetyEvaluationResult.Pass:
+                    yield ContentSafetyEvaluation(
+                        result=batch_result.result,
+                        note=batch_result.note,
+                        metadata=batch_result.metadata,
+                    )
+
+                if failed:
+                    break
+        finally:
+            for task in unique_tasks.values():
+                task.cancel()
+            await asyncio.gather(*unique_tasks.values(), return_exceptions=True)
+
+        # combine the results of the completed batches, in content order
+        for task in tasks:
+            if task.cancelled() or task.exception() is not None:
+                continue
 
-        # combine the results of evaluating each batch
-        for evaluation in results:
-            # add the batch evaluation to the metadata
-            metadata["batches"].append(evaluation.metadata)
+            batch_result = task.result()
 
-            # if the batch fails, the overall result is a fail
-            if evaluation.result == ContentSafetyEvaluationResult.Fail:
-                result = ContentSafetyEvaluationResult.Fail
-                note = evaluation.note
-                break
+            # add the batch evaluation to the metadata
+            metadata["batches"].append(batch_result.metadata)
 
-            # if the batch warns, the overall result is a warn
-            if evaluation.result == ContentSafetyEvaluationResult.Warn:
+            # if the batch warns, the overall result is a warn, unless another batch failed
+            if (
+                result != ContentSafetyEvaluationResult.Fail
+                and batch_result.result == ContentSafetyEvaluationResult.Warn
+            ):
                 result = ContentSafetyEvaluationResult.Warn
-                note = evaluation.note
+                note = batch_result.note
 
-        # return the evaluation result
-        return ContentSafetyEvaluation(
+        # yield the overall evaluation result
+        yield ContentSafetyEvaluation(
             result=result,
             note=note,
             metadata=metadata,
         )
 
-    async def _evaluate_batch(self, text: str) -> ContentSafetyEvaluation:
+    async def _evaluate_batch(self, text: str) -> _BatchResult:
         """
         Evaluate a batch of content for safety using the Azure Content Safety service.
         """
 
         # send the text to the Azure Content Safety service for evaluation
         try:
-            response = ContentSafetyClient(
-                endpoint=self.config_secrets.azure_content_safety_endpoint,
-                credential=self.config_secrets._get_azure_credentials(),
-            ).analyze_text(AnalyzeTextOptions(text=text))
+            async with self._request_semaphore:
+                response = await self._client.analyze_text(
+                    AnalyzeTextOptions(
+                        text=text,
+                        categories=list(self.config.categories),
+                        output_type=AnalyzeTextOutputType.FOUR_SEVERITY_LEVELS,
+                    ),
+                    connection_timeout=self.config.request_timeout,
+                    read_timeout=self.config.request_timeout,
+                    # analysis has no side effects, so the POST request is safe to retry
+                    retry_on_methods=["POST"],
+                )
         except Exception as e:
             # if there is an error, return a fail result with the error message
-            return ContentSafetyEvaluation(
+            return _BatchResult(
                 result=ContentSafetyEvaluationResult.Fail,
                 note=f"Azure Content Safety service error: {e}",
             )
 
         # determine the result based on the severities of the categories
         # where the highest severity across categories determines the result
-        evaluation = ContentSafetyEvaluation(
+        evaluation = _BatchResult(
             result=ContentSafetyEvaluationResult.Pass,
             metadata={
-                **response.as_dict(),
+                "categories": [
+                    {"category": analysis.category, "severity": analysis.severity}
+                    for analysis in response.categories_analysis
+                ],
                 "content_length": len(text),
             },
         )
 
+        # the full response is only converted when requested, as it is costly to build and serialize
+        if self.config.include_raw_response:
+            evaluation.metadata["raw_response"] = response.as_dict()
+
+        # find the category with the highest severity, categories without a severity are skipped
+        highest_category: str | None = None
+        highest_severity = -1
         for text_categories_analysis in response.categories_analysis:
-            # skip categories without a severity
-            if text_categories_analysis.severity is None:
-                continue
+            severity = text_categories_analysis.severity
+            if severity is not None and severity > highest_severity:
+                highest_category = text_categories_analysis.category
+                highest_severity = severity
 
-            # if the severity is above the fail threshold, the result is a fail
-            if text_categories_analysis.severity >= self.config.fail_at_severity:
-                evaluation.result = ContentSafetyEvaluationResult.Fail
-                evaluation.note = f"Content safety category '{text_categories_analysis.category}' failed."
-                break
+                # no other category can change the result once the fail threshold is reached
+                if highest_severity >= self.config.fail_at_severity:
+                    break
 
-            # if the severity is above the warn threshold, the result may be warn
-            # but only if it does not get overridden by a higher severity category later
-            if text_categories_analysis.severity >= self.config.warn_at_severity:
-                evaluation.result = ContentSafetyEvaluationResult.Warn
-                evaluation.note = f"Content safety category '{text_categories_analysis.category}' warned."
+        # if the severity is above the fail threshold, the result is a fail
+        if highest_severity >= self.config.fail_at_severity:
+            evaluation.result = ContentSafetyEvaluationResult.Fail
+            evaluation.note = f"Content safety category '{highest_category}' failed."
+
+        # if the severity is above the warn threshold, the result is a warn
+        elif highest_severity >= self.config.warn_at_severity:
+            evaluation.result = ContentSafetyEvaluationResult.Warn
+            evaluation.note = f"Content safety category '{highest_category}' warned."
 
         # return the evaluation result
         return evaluation
 
 
+_NON_EVALUABLE_CHARACTERS = frozenset(string.whitespace + string.punctuation)
+
+
+def _is_below_evaluable_length(content_list: list[str], min_length: int) -> bool:
+    """
+    Check whether the content has fewer than min_length characters once whitespace and punctuation are ignored.
+    """
+
+    if min_length <= 0:
+        return False
+
+    # count the evaluable characters, stopping as soon as the minimum is reached
+    evaluable_length = 0
+    for item in content_list:
+        for character in item:
+            if character not in _NON_EVALUABLE_CHARACTERS:
+                evaluable_length += 1
+                if evaluable_length >= min_length:
+                    return False
+
+    return True
+
+
+def _batch_content(content_list: list[str], max_length: int) -> Iterator[str]:
+    """
+    Yield batches of at most max_length characters, packing consecutive items into each batch, joined by
+    newlines. Items that fit within max_length are kept whole, moving to the next batch when they do not fit in
+    the current one, which can take one more request than cutting the joined content at fixed offsets. Items
+    that exceed max_length first top up the current batch and are then split, on line or word boundaries where
+    possible. Batches that are empty or only whitespace are not yielded. The joined content is never materialized.
+    """
+
+    fragments: list[str] = []
+    fragments_length = 0
+
+    for item in content_list:
+        # add the item to the current batch if it fits, including the newline separating it from the previous item
+        separator_length = 1 if fragments else 0
+        if fragments_length + separator_length + len(item) <= max_length:
+            if fragments:
+                fragments.append("\n")
+            fragments.append(item)
+            fragments_length += separator_length + len(item)
+            continue
+
+        # items that fit within the maximum length start a new batch, rather than being split
+        if len(item) <= max_length:
+            yield from _non_blank("".join(fragments))
+            fragments = [item]
+            fragments_length = len(item)
+            continue
+
+        # items that exceed the maximum length are split, with the first part topping up the current batch, if
+        # there is room, and the last part carried over to be packed with the following items
+        available_length = max_length - fragments_length - separator_length
+        if available_length <= 0:
+            yield from _non_blank("".join(fragments))
+            fragments = []
+            available_length = max_length
+
+        spans = list(_split_on_boundary(item, max_length, first_max_length=available_length))
+
+        start, end = spans[0]
+        if fragments:
+            fragments.append("\n")
+        fragments.append(item[start:end])
+        yield from _non_blank("".join(fragments))
+
+        for start, end in spans[1:-1]:
+            yield from _non_blank(item[start:end])
+
+        start, end = spans[-1]
+        fragments = [item[start:end]]
+        fragments_length = end - start
+
+    # flush the remainder
+    yield from _non_blank("".join(fragments))
+
+
+def _non_blank(batch: str) -> Iterator[str]:
+    """
+    Yield the batch unless it is empty or only whitespace, which is not worth a request to the service.
+    """
+
+    if batch and not batch.isspace():
+        yield batch
+
+
+def _split_on_boundary(text: str, max_length: int, first_max_length: int | None = None) -> Iterator[tuple[int, int]]:
+    """
+    Yield (start, end) spans of at most max_length characters covering the text, ending each span after the
+    last newline in the window, falling back to the last space, and only splitting mid-word if there is neither.
+    The first span is limited to first_max_length characters, when given, to fill the remainder of a batch.
+    """
+
+    start = 0
+    span_max_length = max_length if first_max_length is None else first_max_length
+    while len(text) - start > span_max_length:
+        end = start + span_max_length
+
+        boundary = text.rfind("\n", start + 1, end)
+        if boundary < 0:
+            boundary = text.rfind(" ", start + 1, end)
+        if boundary >= 0:
+            end = boundary + 1
+
+        yield start, end
+        start = end
+        span_max_length = max_length
+
+    yield start, len(text)
+
+
 # endregion
@@ -5,6 +5,24 @@ import pytest
 from semantic_workbench_assistant import settings, storage
 
 
+@pytest.fixture(scope="session", autouse=True)
+def session_storage_settings() -> Iterator[storage.FileStorageSettings]:
+    """
+    Points the storage settings at a temporary directory for the whole session. Tests that need storage
+    isolated from other tests can still patch the settings with the storage_settings fixture.
+    """
+    previous_storage_settings = settings.storage
+    session_storage_settings = settings.storage.model_copy()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        session_storage_settings.root = temp_dir
+        settings.storage = session_storage_settings
+        try:
+            yield session_storage_settings
+        finally:
+            settings.storage = previous_storage_settings
+
+
 @pytest.fixture
 def storage_settings(request: pytest.FixtureRequest) -> Iterator[storage.FileStorageSettings]:
     storage_settings = settings.storage.model_copy()
@@ -1,19 +1,23 @@
+import asyncio
+import collections
 import datetime
 import io
 import pathlib
-import random
+import shutil
 import tempfile
 import uuid
 from contextlib import asynccontextmanager
-from typing import IO, AsyncIterator
+from types import MappingProxyType
+from typing import IO, Any, AsyncIterator, Awaitable, Callable, Iterator
 from unittest import mock
 
 import httpx
 import pytest
+import pytest_asyncio
 import semantic_workbench_api_model
 import semantic_workbench_api_model.assistant_service_client
 from asgi_lifespan import LifespanManager
-from fastapi import HTTPException
+from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from semantic_workbench_api_model import (
     assistant_model,
@@ -21,7 +25,6 @@ from semantic_workbench_api_model import (
     workbench_model,
     workbench_service_client,
 )
-from semantic_workbench_assistant import settings, storage
 from semantic_workbench_assistant.assistant_app import (
     AssistantApp,
     AssistantContext,
@@ -41,6 +44,70 @@ from semantic_workbench_assistant.config import (
     ConfigSecretStr,
 )
 
+# the tests in this module share a single assistant app, service and lifespan; when run in parallel with
+# pytest-xdist and --dist loadgroup, keep them on one worker so the service is only started once
+pytestmark = pytest.mark.xdist_group("assistant_app")
+
+
+_FIXED_TS = datetime.datetime(2024, 1, 1, 0, 0, 0)
+
+_CHAT_MESSAGE = workbench_model.ConversationMessage(
+    id=uuid.uuid4(),
+    sender=workbench_model.MessageSender(participant_role=workbench_model.ParticipantRole.user, participant_id="user"),
+    message_type=workbench_model.MessageType.chat,
+    timestamp=_FIXED_TS,
+    content_type="text/plain",
+    content="Hello, world",
+    filenames=[],
+    metadata={},
+)
+
+# message_created event fields, less the conversation id, with the message data dumped once at import
+_CHAT_MESSAGE_EVENT_TEMPLATE = {
+    "correlation_id": "",
+    "event": workbench_model.ConversationEventType.message_created,
+    "data": {"message": _CHAT_MESSAGE.model_dump(mode="json")},
+}
+_NOTICE_MESSAGE_EVENT_TEMPLATE = {
+    **_CHAT_MESSAGE_EVENT_TEMPLATE,
+    "data": {
+        "message": _CHAT_MESSAGE.model_copy(update={"message_type": workbench_model.MessageType.notice}).model_dump(
+            mode="json"
+        )
+    },
+}
+
+
+# expected schemas for the TestConfigModel and TestConfigSecretModel config, shared by the tests; only the
+# top-level mappings are read-only, the nested dicts must not be modified
+_EXPECTED_CONFIG_JSON_SCHEMA = MappingProxyType({
+    "$defs": {
+        "ConfigSecretStr": {"format": "password", "type": "string", "writeOnly": True},
+        "TestConfigModel": {
+            "properties": {"test_key": {"default": "test_value", "title": "Test Key", "type": "string"}},
+            "title": "TestConfigModel",
+            "type": "object",
+        },
+        "TestConfigSecretModel": {
+            "properties": {"secret_field": {"$ref": "#/$defs/ConfigSecretStr", "default": ""}},
+            "title": "TestConfigSecretModel",
+            "type": "object",
+        },
+    },
+    "properties": {
+        "config": {"$ref": "#/$defs/TestConfigModel"},
+        "config_secrets": {"$ref": "#/$defs/TestConfigSecretModel"},
+    },
+    "required": ["config", "config_secrets"],
+    "title": "CombinedConfigModel",
+    "type": "object",
+})
+
+_EXPECTED_CONFIG_UI_SCHEMA = MappingProxyType({
+    "config": {"ui:options": {"hide_title": True}},
+    "config_secrets": {"ui:options": {"hide_title": True}, "secret_field": {"ui:options": {"widget": "password"}}},
+})
+
 
 class AllOKTransport(httpx.AsyncBaseTransport):
     """
@@ -51,31 +118,117 @@ class AllOKTransport(httpx.AsyncBaseTransport):
         return httpx.Response(200)
 
 
-async def test_assistant_with_event_handlers(
-    monkeypatch: pytest.MonkeyPatch, storage_settings: storage.FileStorageSettings
-) -> None:
-    monkeypatch.setattr(settings, "storage", storage_settings)
+class Spy:
+    """
+    Wraps an object, recording the name and arguments of each method call made through the wrapper.
+    """
+
+    def __init__(self, target: Any) -> None:
+        self.target = target
+        self.calls: list[tuple[str, tuple[Any, ...], dict[str, Any]]] = []
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self.target, name)
+        if not callable(attribute):
+            return attribute
+
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            self.calls.append((name, args, kwargs))
+            return attribute(*args, **kwargs)
+
+        return wrapper
+
+    def call_args(self, name: str) -> list[tuple[Any, ...]]:
+        """
+        Returns the positional arguments of each call made to the named method, in call order.
+        """
+        return [args for call_name, args, _ in self.calls if call_name == name]
+
+
+class TestInspectorImplementation:
+    display_name = "Test"
+    description = "Test inspector"
+
+    async def get(self, context: ConversationContext) -> AssistantConversationInspectorStateDataModel:
+        return AssistantConversationInspectorStateDataModel(
+            data={"test": "data"},
+            json_schema={},
+            ui_schema={},
+        )
+
+
+class SimpleStateExporter:
+    def __init__(self) -> None:
+        self.data = bytearray()
+
+    @asynccontextmanager
+    async def export(self, conversation_context: ConversationContext) -> AsyncIterator[IO[bytes]]:
+        yield io.BytesIO(self.data)
+
+    async def import_(self, conversation_context: ConversationContext, stream: IO[bytes]) -> None:
+        self.data = stream.read()
+
+
+class TestConfigModel(BaseModel):
+    __test__ = False
+
+    test_key: str = "test_value"
+
+
+class TestConfigSecretModel(BaseModel):
+    __test__ = False
+
+    secret_field: ConfigSecretStr = ""
+
+
+@pytest.fixture(scope="module")
+def event_calls() -> collections.Counter[tuple[str, str]]:
+    """
+    Counts of the event handler calls, keyed by event name and assistant or conversation id.
+    """
+    return collections.Counter()
+
+
+@pytest.fixture(scope="module")
+def state_exporter() -> SimpleStateExporter:
+    return SimpleStateExporter()
+
+
+@pytest.fixture(scope="module")
+def state_exporter_wrapper(state_exporter: SimpleStateExporter) -> Spy:
+    # wrap the instance so we can check calls to it
+    return Spy(state_exporter)
 
+
+@pytest.fixture(scope="module")
+def config_provider_wrapper() -> Spy:
+    config_provider = BaseModelAssistantConfigWithSecrets(TestConfigModel(), TestConfigSecretModel()).provider
+    # wrap the provider so we can check calls to it
+    return Spy(config_provider)
+
+
+@pytest.fixture(scope="module")
+def assistant_app(
+    event_calls: collections.Counter[tuple[str, str]],
+    state_exporter_wrapper: Spy,
+    config_provider_wrapper: Spy,
+) -> AssistantApp:
     app = AssistantApp(
         assistant_service_id="assistant_id",
         assistant_service_name="service name",
         assistant_service_description="service description",
+        inspector_state_providers={"test": TestInspectorImplementation()},
+        conversation_data_exporter=state_exporter_wrapper,
+        config_provider=config_provider_wrapper,
     )
 
-    assistant_created_calls = 0
-    conversation_created_calls = 0
-    message_created_calls = 0
-    message_chat_created_calls = 0
-
     @app.events.assistant.on_created
     async def on_assistant_created(assistant_context: AssistantContext) -> None:
-        nonlocal assistant_created_calls
-        assistant_created_calls += 1
+        event_calls["assistant_created", assistant_context.id] += 1
 
     @app.events.conversation.on_created
     async def on_conversation_created(conversation_context: ConversationContext) -> None:
-        nonlocal conversation_created_calls
-        conversation_created_calls += 1
+        event_calls["conversation_created", conversation_context.id] += 1
 
     @app.events.conversation.message.on_created
     def on_message_created(
@@ -83,8 +236,7 @@ async def test_assistant_with_event_handlers(
         _: workbench_model.ConversationEvent,
         message: workbench_model.ConversationMessage,
     ) -> None:
-        nonlocal message_created_calls
-        message_created_calls += 1
+        event_calls["message_created", conversation_context.id] += 1
 
     @app.events.conversation.message.chat.on_created
     async def on_chat_message(
@@ -92,505 +244,434 @@ async def test_assistant_with_event_handlers(
         _: workbench_model.ConversationEvent,
         message: workbench_model.ConversationMessage,
     ) -> None:
-        nonlocal message_chat_created_calls
-        message_chat_created_calls += 1
+        event_calls["message_chat_created", conversation_context.id] += 1
 
-    service = app.fastapi_app()
+    return app
 
-    monkeypatch.setattr(assistant_service_client, "httpx_transport", httpx.ASGITransport(app=service))
-    monkeypatch.setattr(workbench_service_client, "httpx_transport", AllOKTransport())
 
-    async with LifespanManager(service):
-        assistant_id = uuid.uuid4()
-        assistant_request = assistant_model.AssistantPutRequestModel(assistant_name="my assistant")
+# the assistant app tests share a single app, service and lifespan, so those tests are marked to run
+# on the module-scoped event loop that the service is started on; the other async tests in this module
+# use the same loop rather than creating one per test
+@pytest_asyncio.fixture(scope="module")
+async def assistant_service(assistant_app: AssistantApp) -> AsyncIterator[FastAPI]:
+    # the built-in monkeypatch fixture is function-scoped, so use a module-scoped context instead
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # the service uses the session storage settings, set by the autouse fixture in conftest.py
+        service = assistant_app.fastapi_app()
 
-        client_builder = assistant_service_client.AssistantServiceClientBuilder("https://fake", "")
-        service_client = client_builder.for_service()
-        instance_client = client_builder.for_assistant_instance(assistant_id)
-
-        await service_client.put_assistant_instance(
-            assistant_id=assistant_id, request=assistant_request, from_export=None
-        )
+        monkeypatch.setattr(assistant_service_client, "httpx_transport", httpx.ASGITransport(app=service))
+        monkeypatch.setattr(workbench_service_client, "httpx_transport", AllOKTransport())
 
-        assert assistant_created_calls == 1
+        async with LifespanManager(service):
+            yield service
 
-        conversation_id = uuid.uuid4()
 
-        await instance_client.put_conversation(
-            request=assistant_model.ConversationPutRequestModel(
-                id=str(conversation_id),
-                title="My conversation",
-            ),
-            from_export=None,
-        )
+@pytest.fixture(scope="module")
+def client_builder(assistant_service: FastAPI) -> assistant_service_client.AssistantServiceClientBuilder:
+    return assistant_service_client.AssistantServiceClientBuilder("https://fake", "")
 
-        assert conversation_created_calls == 1
-
-        # send a message of type "chat"
-        message_id = uuid.uuid4()
-        await instance_client.post_conversation_event(
-            event=workbench_model.ConversationEvent(
-                conversation_id=conversation_id,
-                correlation_id="",
-                event=workbench_model.ConversationEventType.message_created,
-                data={
-                    "message": workbench_model.ConversationMessage(
-                        id=message_id,
-                        sender=workbench_model.MessageSender(
-                            participant_role=workbench_model.ParticipantRole.user, participant_id="user"
-                        ),
-                        message_type=workbench_model.MessageType.chat,
-                        timestamp=datetime.datetime.now(),
-                        content_type="text/plain",
-                        content="Hello, world",
-                        filenames=[],
-                        metadata={},
-                    ).model_dump(mode="json")
-                },
-            )
-        )
 
-        assert message_created_calls == 1
-        assert message_chat_created_calls == 1
-
-        # send a message of type "notice"
-        await instance_client.post_conversation_event(
-            event=workbench_model.ConversationEvent(
-                conversation_id=conversation_id,
-                correlation_id="",
-                event=workbench_model.ConversationEventType.message_created,
-                data={
-                    "message": workbench_model.ConversationMessage(
-                        id=message_id,
-                        sender=workbench_model.MessageSender(
-                            participant_role=workbench_model.ParticipantRole.user, participant_id="user"
-                        ),
-                        message_type=workbench_model.MessageType.notice,
-                        timestamp=datetime.datetime.now(),
-                        content_type="text/plain",
-                        content="Hello, world",
-                        filenames=[],
-                        metadata={},
-                    ).model_dump(mode="json")
-                },
-            )
-        )
+@pytest_asyncio.fixture(scope="module")
+async def service_client(
+    client_builder: assistant_service_client.AssistantServiceClientBuilder,
+) -> AsyncIterator[assistant_service_client.AssistantServiceClient]:
+    async with client_builder.for_service() as service_client:
+        yield service_client
 
-        assert message_created_calls == 2
-        assert message_chat_created_calls == 1
 
+@pytest.fixture
+def assistant_id() -> uuid.UUID:
+    return uuid.uuid4()
 
-async def test_assistant_with_inspector(
-    monkeypatch: pytest.MonkeyPatch, storage_settings: storage.FileStorageSettings
-) -> None:
-    monkeypatch.setattr(settings, "storage", storage_settings)
 
-    class TestInspectorImplementation:
-        display_name = "Test"
-        description = "Test inspector"
+@pytest.fixture(scope="module")
+def assistant_put_request() -> assistant_model.AssistantPutRequestModel:
+    return assistant_model.AssistantPutRequestModel(assistant_name="my assistant")
 
-        async def get(self, context: ConversationContext) -> AssistantConversationInspectorStateDataModel:
-            return AssistantConversationInspectorStateDataModel(
-                data={"test": "data"},
-                json_schema={},
-                ui_schema={},
-            )
 
-    app = AssistantApp(
-        assistant_service_id="assistant_id",
-        assistant_service_name="service name",
-        assistant_service_description="service description",
-        inspector_state_providers={"test": TestInspectorImplementation()},
-    )
+@pytest.fixture
+def conversation_id() -> uuid.UUID:
+    return uuid.uuid4()
 
-    service = app.fastapi_app()
 
-    monkeypatch.setattr(assistant_service_client, "httpx_transport", httpx.ASGITransport(app=service))
-    monkeypatch.setattr(workbench_service_client, "httpx_transport", AllOKTransport())
+@pytest.fixture
+def conversation_put_request(conversation_id: uuid.UUID) -> assistant_model.ConversationPutRequestModel:
+    return assistant_model.ConversationPutRequestModel(id=str(conversation_id), title="My conversation")
 
-    async with LifespanManager(service):
-        assistant_id = uuid.uuid4()
-        conversation_id = uuid.uuid4()
 
-        assistant_request = assistant_model.AssistantPutRequestModel(assistant_name="my assistant")
+@pytest.fixture
+def instance_client(
+    client_builder: assistant_service_client.AssistantServiceClientBuilder, assistant_id: uuid.UUID
+) -> assistant_service_client.AssistantInstanceClient:
+    # the instance clients share the module's ASGI transport, so there is no connection pool to close;
+    # a sync fixture also keeps the tests on the module-scoped event loop
+    return client_builder.for_assistant_instance(assistant_id)
 
-        client_builder = assistant_service_client.AssistantServiceClientBuilder("https://fake", "")
-        service_client = client_builder.for_service()
-        instance_client = client_builder.for_assistant_instance(assistant_id)
 
-        await service_client.put_assistant_instance(
-            assistant_id=assistant_id, request=assistant_request, from_export=None
-        )
-        await instance_client.put_conversation(
-            request=assistant_model.ConversationPutRequestModel(
-                id=str(conversation_id),
-                title="My conversation",
-            ),
-            from_export=None,
-        )
+@pytest.mark.asyncio(scope="module")
+async def test_assistant_with_event_handlers(
+    service_client: assistant_service_client.AssistantServiceClient,
+    instance_client: assistant_service_client.AssistantInstanceClient,
+    assistant_id: uuid.UUID,
+    assistant_put_request: assistant_model.AssistantPutRequestModel,
+    conversation_id: uuid.UUID,
+    conversation_put_request: assistant_model.ConversationPutRequestModel,
+    event_calls: collections.Counter[tuple[str, str]],
+) -> None:
+    await service_client.put_assistant_instance(
+        assistant_id=assistant_id, request=assistant_put_request, from_export=None
+    )
 
-        response = await instance_client.get_state_descriptions(conversation_id=conversation_id)
-        assert response == assistant_model.StateDescriptionListResponseModel(
-            states=[
-                assistant_model.StateDescriptionResponseModel(
-                    id="test",
-                    display_name="Test",
-                    description="Test inspector",
-                )
-            ]
-        )
+    assert event_calls["assistant_created", str(assistant_id)] == 1
 
-        response = await instance_client.get_state(conversation_id=conversation_id, state_id="test")
-        assert response == assistant_model.StateResponseModel(
-            id="test",
-            data={"test": "data"},
-            json_schema={},
-            ui_schema={},
-        )
+    await instance_client.put_conversation(
+        request=conversation_put_request,
+        from_export=None,
+    )
 
+    assert event_calls["conversation_created", str(conversation_id)] == 1
 
-async def test_assistant_with_state_exporter(
-    monkeypatch: pytest.MonkeyPatch, storage_settings: storage.FileStorageSettings
-) -> None:
-    monkeypatch.setattr(settings, "storage", storage_settings)
+    # send a message of type "chat"
+    await instance_client.post_conversation_event(
+        event=workbench_model.ConversationEvent.model_validate(
+            dict(_CHAT_MESSAGE_EVENT_TEMPLATE, conversation_id=conversation_id)
+        )
+    )
 
-    class SimpleStateExporter:
-        def __init__(self) -> None:
-            self.data = bytearray()
+    assert event_calls["message_created", str(conversation_id)] == 1
+    assert event_calls["message_chat_created", str(conversation_id)] == 1
 
-        @asynccontextmanager
-        async def export(self, conversation_context: ConversationContext) -> AsyncIterator[IO[bytes]]:
-            yield io.BytesIO(self.data)
+    # send a message of type "notice"
+    await instance_client.post_conversation_event(
+        event=workbench_model.ConversationEvent.model_validate(
+            dict(_NOTICE_MESSAGE_EVENT_TEMPLATE, conversation_id=conversation_id)
+        )
+    )
 
-        async def import_(self, conversation_context: ConversationContext, stream: IO[bytes]) -> None:
-            self.data = stream.read()
+    assert event_calls["message_created", str(conversation_id)] == 2
+    assert event_calls["message_chat_created", str(conversation_id)] == 1
 
-    state_exporter = SimpleStateExporter()
-    # wrap the instance so we can check calls to it
-    state_exporter_wrapper = mock.Mock(wraps=state_exporter)
 
-    app = AssistantApp(
-        assistant_service_id="assistant_id",
-        assistant_service_name="service name",
-        assistant_service_description="service description",
-        conversation_data_exporter=state_exporter_wrapper,
+@pytest.mark.asyncio(scope="module")
+async def test_assistant_with_inspector(
+    service_client: assistant_service_client.AssistantServiceClient,
+    instance_client: assistant_service_client.AssistantInstanceClient,
+    assistant_id: uuid.UUID,
+    assistant_put_request: assistant_model.AssistantPutRequestModel,
+    conversation_id: uuid.UUID,
+    conversation_put_request: assistant_model.ConversationPutRequestModel,
+) -> None:
+    await service_client.put_assistant_instance(
+        assistant_id=assistant_id, request=assistant_put_request, from_export=None
+    )
+    await instance_client.put_conversation(
+        request=conversation_put_request,
+        from_export=None,
     )
 
-    service = app.fastapi_app()
+    # the state descriptions and state are read-only requests, so they can be made concurrently
+    state_descriptions_response, state_response = await asyncio.gather(
+        instance_client.get_state_descriptions(conversation_id=conversation_id),
+        instance_client.get_state(conversation_id=conversation_id, state_id="test"),
+    )
 
-    monkeypatch.setattr(assistant_service_client, "httpx_transport", httpx.ASGITransport(app=service))
-    monkeypatch.setattr(workbench_service_client, "httpx_transport", AllOKTransport())
+    assert state_descriptions_response == assistant_model.StateDescriptionListResponseModel(
+        states=[
+            assistant_model.StateDescriptionResponseModel(
+                id="test",
+                display_name="Test",
+                description="Test inspector",
+            )
+        ]
+    )
 
-    async with LifespanManager(service):
-        assistant_id = uuid.uuid4()
-        assistant_request = assistant_model.AssistantPutRequestModel(assistant_name="my assistant")
+    assert state_response == assistant_model.StateResponseModel(
+        id="test",
+        data={"test": "data"},
+        json_schema={},
+        ui_schema={},
+    )
 
-        client_builder = assistant_service_client.AssistantServiceClientBuilder("https://fake", "")
-        service_client = client_builder.for_service()
-        instance_client = client_builder.for_assistant_instance(assistant_id)
 
-        await service_client.put_assistant_instance(
-            assistant_id=assistant_id, request=assistant_request, from_export=None
-        )
+@pytest.mark.asyncio(scope="module")
+async def test_assistant_with_state_exporter(
+    service_client: assistant_service_client.AssistantServiceClient,
+    instance_client: assistant_service_client.AssistantInstanceClient,
+    assistant_id: uuid.UUID,
+    assistant_put_request: assistant_model.AssistantPutRequestModel,
+    conversation_id: uuid.UUID,
+    conversation_put_request: assistant_model.ConversationPutRequestModel,
+    state_exporter: SimpleStateExporter,
+    state_exporter_wrapper: Spy,
+) -> None:
+    state_exporter_wrapper.calls.clear()
 
-        conversation_id = uuid.uuid4()
+    await service_client.put_assistant_instance(
+        assistant_id=assistant_id, request=assistant_put_request, from_export=None
+    )
 
-        import_bytes = bytearray(random.getrandbits(8) for _ in range(10))
+    import_bytes = b"\x00\x01\x02\x03\x04\x05\x06\x07\x08\x09"
 
-        await instance_client.put_conversation(
-            request=assistant_model.ConversationPutRequestModel(
-                id=str(conversation_id),
-                title="My conversation",
-            ),
-            from_export=io.BytesIO(import_bytes),
-        )
+    await instance_client.put_conversation(
+        request=conversation_put_request,
+        from_export=io.BytesIO(import_bytes),
+    )
 
-        assert state_exporter_wrapper.import_.called
-        assert state_exporter_wrapper.import_.call_args[0][0] == ConversationContext(
-            id=str(conversation_id),
-            title="My conversation",
-            assistant=mock.ANY,
-        )
+    assert state_exporter_wrapper.call_args("import_")
+    assert state_exporter_wrapper.call_args("import_")[-1][0] == ConversationContext(
+        id=str(conversation_id),
+        title="My conversation",
+        assistant=mock.ANY,
+    )
 
-        assert state_exporter.data == import_bytes
+    assert state_exporter.data == import_bytes
 
-        bytes_out = bytearray()
-        async with instance_client.get_exported_conversation_data(conversation_id=conversation_id) as stream:
-            async for chunk in stream:
-                bytes_out.extend(chunk)
+    bytes_out = bytearray()
+    async with instance_client.get_exported_conversation_data(conversation_id=conversation_id) as stream:
+        async for chunk in stream:
+            bytes_out.extend(chunk)
 
-        assert state_exporter_wrapper.export.called
-        assert state_exporter_wrapper.export.call_args[0][0] == ConversationContext(
-            id=str(conversation_id),
-            title="My conversation",
-            assistant=mock.ANY,
-        )
+    assert state_exporter_wrapper.call_args("export")
+    assert state_exporter_wrapper.call_args("export")[-1][0] == ConversationContext(
+        id=str(conversation_id),
+        title="My conversation",
+        assistant=mock.ANY,
+    )
 
-        assert bytes_out == import_bytes
+    assert bytes_out == import_bytes
 
 
+@pytest.mark.asyncio(scope="module")
 async def test_assistant_with_config_provider(
-    monkeypatch: pytest.MonkeyPatch, storage_settings: storage.FileStorageSettings
+    service_client: assistant_service_client.AssistantServiceClient,
+    instance_client: assistant_service_client.AssistantInstanceClient,
+    assistant_id: uuid.UUID,
+    assistant_put_request: assistant_model.AssistantPutRequestModel,
+    config_provider_wrapper: Spy,
 ) -> None:
-    monkeypatch.setattr(settings, "storage", storage_settings)
+    config_provider_wrapper.calls.clear()
+
+    await service_client.put_assistant_instance(
+        assistant_id=assistant_id, request=assistant_put_request, from_export=None
+    )
 
-    class TestConfigModel(BaseModel):
-        test_key: str = "test_value"
+    response = await instance_client.get_config()
+    assert response == assistant_model.ConfigResponseModel(
+        config={"config": {"test_key": "test_value"}, "config_secrets": {"secret_field": ""}},
+        json_schema=_EXPECTED_CONFIG_JSON_SCHEMA,
+        ui_schema=_EXPECTED_CONFIG_UI_SCHEMA,
+    )
+    assert config_provider_wrapper.call_args("get")
 
-    class TestConfigSecretModel(BaseModel):
-        secret_field: ConfigSecretStr = ""
+    config_provider_wrapper.calls.clear()
 
-    config_provider = BaseModelAssistantConfigWithSecrets(TestConfigModel(), TestConfigSecretModel()).provider
-    # wrap the provider so we can check calls to it
-    config_provider_wrapper = mock.Mock(wraps=config_provider)
-
-    expected_json_schema = {
-        "$defs": {
-            "ConfigSecretStr": {"format": "password", "type": "string", "writeOnly": True},
-            "TestConfigModel": {
-                "properties": {"test_key": {"default": "test_value", "title": "Test Key", "type": "string"}},
-                "title": "TestConfigModel",
-                "type": "object",
-            },
-            "TestConfigSecretModel": {
-                "properties": {"secret_field": {"$ref": "#/$defs/ConfigSecretStr", "default": ""}},
-                "title": "TestConfigSecretModel",
-                "type": "object",
-            },
-        },
-        "properties": {
-            "config": {"$ref": "#/$defs/TestConfigModel"},
-            "config_secrets": {"$ref": "#/$defs/TestConfigSecretModel"},
-        },
-        "required": ["config", "config_secrets"],
-        "title": "CombinedConfigModel",
-        "type": "object",
+    response = await instance_client.put_config(
+        assistant_model.ConfigPutRequestModel(
+            config={"config": {"test_key": "new_value"}, "config_secrets": {"secret_field": "new_secret"}}
+        )
+    )
+    assert response == assistant_model.ConfigResponseModel(
+        config={"config": {"test_key": "new_value"}, "config_secrets": {"secret_field": "**********"}},
+        json_schema=_EXPECTED_CONFIG_JSON_SCHEMA,
+        ui_schema=_EXPECTED_CONFIG_UI_SCHEMA,
+    )
+    assert config_provider_wrapper.call_args("set")
+    assert config_provider_wrapper.call_args("set")[-1][1] == {
+        "config": {"test_key": "new_value"},
+        "config_secrets": {"secret_field": "new_secret"},
     }
 
-    expected_ui_schema = {
-        "config": {"ui:options": {"hide_title": True}},
-        "config_secrets": {"ui:options": {"hide_title": True}, "secret_field": {"ui:options": {"widget": "password"}}},
-    }
+    config_provider_wrapper.calls.clear()
 
-    app = AssistantApp(
-        assistant_service_id="assistant_id",
-        assistant_service_name="service name",
-        assistant_service_description="service description",
-        config_provider=config_provider_wrapper,
+    response = await instance_client.get_config()
+    assert response == assistant_model.ConfigResponseModel(
+        config={"config": {"test_key": "new_value"}, "config_secrets": {"secret_field": "**********"}},
+        json_schema=_EXPECTED_CONFIG_JSON_SCHEMA,
+        ui_schema=_EXPECTED_CONFIG_UI_SCHEMA,
     )
+    assert config_provider_wrapper.call_args("get")
 
-    service = app.fastapi_app()
-
-    monkeypatch.setattr(assistant_service_client, "httpx_transport", httpx.ASGITransport(app=service))
-    monkeypatch.setattr(workbench_service_client, "httpx_transport", AllOKTransport())
+    with pytest.raises(semantic_workbench_api_model.assistant_service_client.AssistantResponseError) as e:
+        await instance_client.put_config(
+            assistant_model.ConfigPutRequestModel(config={"config": {"test_key": {"invalid_value": 1}}})
+        )
 
-    async with LifespanManager(service):
-        assistant_id = uuid.uuid4()
-        assistant_request = assistant_model.AssistantPutRequestModel(assistant_name="my assistant")
+    assert e.value.status_code == 400
 
-        client_builder = assistant_service_client.AssistantServiceClientBuilder("https://fake", "")
-        service_client = client_builder.for_service()
-        instance_client = client_builder.for_assistant_instance(assistant_id)
 
-        await service_client.put_assistant_instance(
-            assistant_id=assistant_id, request=assistant_request, from_export=None
-        )
+@pytest.fixture(scope="module")
+def exporter_tmp_path() -> Iterator[pathlib.Path]:
+    """
+    A base directory for the file system exporter tests, which holds the shared source and template
+    directories along with the per-test destination directories, and is removed once for the module.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        yield pathlib.Path(temp_dir)
 
-        response = await instance_client.get_config()
-        assert response == assistant_model.ConfigResponseModel(
-            config={"config": {"test_key": "test_value"}, "config_secrets": {"secret_field": ""}},
-            json_schema=expected_json_schema,
-            ui_schema=expected_ui_schema,
-        )
-        assert config_provider_wrapper.get.called
 
-        config_provider_wrapper.reset_mock()
+@pytest.fixture(scope="module")
+def exporter_src_dir_path(exporter_tmp_path: pathlib.Path) -> pathlib.Path:
+    """
+    A source directory for the file system exporter tests, which the export only reads from.
+    """
+    src_dir_path = exporter_tmp_path / "src"
 
-        response = await instance_client.put_config(
-            assistant_model.ConfigPutRequestModel(
-                config={"config": {"test_key": "new_value"}, "config_secrets": {"secret_field": "new_secret"}}
-            )
-        )
-        assert response == assistant_model.ConfigResponseModel(
-            config={"config": {"test_key": "new_value"}, "config_secrets": {"secret_field": "**********"}},
-            json_schema=expected_json_schema,
-            ui_schema=expected_ui_schema,
-        )
-        assert config_provider_wrapper.set.called
-        assert config_provider_wrapper.set.call_args[0][1] == {
-            "config": {"test_key": "new_value"},
-            "config_secrets": {"secret_field": "new_secret"},
-        }
-
-        config_provider_wrapper.reset_mock()
-
-        response = await instance_client.get_config()
-        assert response == assistant_model.ConfigResponseModel(
-            config={"config": {"test_key": "new_value"}, "config_secrets": {"secret_field": "**********"}},
-            json_schema=expected_json_schema,
-            ui_schema=expected_ui_schema,
-        )
-        assert config_provider_wrapper.get.called
+    src_dir_path.mkdir()
 
-        with pytest.raises(semantic_workbench_api_model.assistant_service_client.AssistantResponseError) as e:
-            await instance_client.put_config(
-                assistant_model.ConfigPutRequestModel(config={"config": {"test_key": {"invalid_value": 1}}})
-            )
+    (src_dir_path / "test.txt").write_text("Hello, world")
 
-        assert e.value.status_code == 400
+    sub_dir_path = src_dir_path / "subdir"
 
+    sub_dir_path.mkdir()
 
-async def test_file_system_storage_state_data_provider_to_empty_dir(monkeypatch: pytest.MonkeyPatch) -> None:
-    with tempfile.TemporaryDirectory() as src_temp_dir, tempfile.TemporaryDirectory() as dest_temp_dir:
-        src_dir_path = pathlib.Path(src_temp_dir)
+    (sub_dir_path / "test.bin").write_bytes(bytes([1, 2, 3, 4]))
 
-        (src_dir_path / "test.txt").write_text("Hello, world")
+    return src_dir_path
 
-        sub_dir_path = src_dir_path / "subdir"
 
-        sub_dir_path.mkdir()
+@pytest.fixture(scope="module")
+def exporter_dest_template_dir_path(exporter_tmp_path: pathlib.Path) -> pathlib.Path:
+    """
+    The contents of a non-empty destination directory for the file system exporter tests, which the
+    tests copy into their own destination directories, as the import overwrites and deletes from them.
+    """
+    dest_template_dir_path = exporter_tmp_path / "dest-template"
 
-        (sub_dir_path / "test.bin").write_bytes(bytes([1, 2, 3, 4]))
+    dest_template_dir_path.mkdir()
 
-        src_conversation_context = ConversationContext(
-            id=str(uuid.uuid4()),
-            title="My conversation",
-            assistant=AssistantContext(
-                _assistant_service_id="",
-                id=str(uuid.uuid4()),
-                name="my assistant",
-            ),
-        )
+    (dest_template_dir_path / "test.txt").write_text("this file will be overwritten")
 
-        dest_dir_path = pathlib.Path(dest_temp_dir)
+    dest_sub_dir_path = dest_template_dir_path / "subdir-gets-deleted"
 
-        dest_conversation_context = ConversationContext(
-            id=str(uuid.uuid4()),
-            title="My conversation",
-            assistant=AssistantContext(
-                _assistant_service_id="",
-                id=str(uuid.uuid4()),
-                name="my assistant",
-            ),
-        )
+    dest_sub_dir_path.mkdir()
 
-        def file_storage_context_get_mock(conversation_context: ConversationContext) -> FileStorageContext:
-            if conversation_context == src_conversation_context:
-                return FileStorageContext(directory=src_dir_path)
-            return FileStorageContext(directory=dest_dir_path)
+    (dest_sub_dir_path / "test.bin").write_bytes(bytes([1, 2, 3, 4]))
 
-        with mock.patch(
-            "semantic_workbench_assistant.assistant_app.FileStorageContext.get",
-            side_effect=file_storage_context_get_mock,
-        ):
-            data_provider = FileStorageConversationDataExporter()
+    return dest_template_dir_path
 
-            async with data_provider.export(src_conversation_context) as stream:
-                await data_provider.import_(dest_conversation_context, stream)
 
-            assert (dest_dir_path / "test.txt").read_text() == "Hello, world"
+@pytest.mark.asyncio(scope="module")
+@pytest.mark.parametrize("dest_pre_populated", [False, True])
+async def test_file_system_storage_state_data_provider(
+    exporter_tmp_path: pathlib.Path,
+    exporter_src_dir_path: pathlib.Path,
+    exporter_dest_template_dir_path: pathlib.Path,
+    dest_pre_populated: bool,
+) -> None:
+    dest_dir_path = exporter_tmp_path / f"dest-{uuid.uuid4().hex}"
 
-            assert (dest_dir_path / "subdir" / "test.bin").read_bytes() == bytes([1, 2, 3, 4])
+    dest_dir_path.mkdir()
 
+    dest_sub_dir_path = dest_dir_path / "subdir-gets-deleted"
 
-async def test_file_system_storage_state_data_provider_to_non_empty_dir():
-    with tempfile.TemporaryDirectory() as src_temp_dir, tempfile.TemporaryDirectory() as dest_temp_dir:
+    if dest_pre_populated:
         # set up contents of the non-empty destination directory
-        dest_dir_path = pathlib.Path(dest_temp_dir)
-
-        (dest_dir_path / "test.txt").write_text("this file will be overwritten")
+        shutil.copytree(exporter_dest_template_dir_path, dest_dir_path, dirs_exist_ok=True)
 
-        dest_sub_dir_path = dest_dir_path / "subdir-gets-deleted"
+    # export and import
 
-        dest_sub_dir_path.mkdir()
-
-        (dest_sub_dir_path / "test.bin").write_bytes(bytes([1, 2, 3, 4]))
+    src_conversation_context = ConversationContext(
+        id=str(uuid.uuid4()),
+        title="My conversation",
+        assistant=AssistantContext(
+            _assistant_service_id="",
+            id=str(uuid.uuid4()),
+            name="my assistant",
+        ),
+    )
 
-        # set up contents of the source directory
+    dest_conversation_context = ConversationContext(
+        id=str(uuid.uuid4()),
+        title="My conversation",
+        assistant=AssistantContext(
+            _assistant_service_id="",
+            id=str(uuid.uuid4()),
+            name="my assistant",
+        ),
+    )
 
-        src_dir_path = pathlib.Path(src_temp_dir)
+    def file_storage_context_get_mock(conversation_context: ConversationContext) -> FileStorageContext:
+        if conversation_context == src_conversation_context:
+            return FileStorageContext(directory=exporter_src_dir_path)
+        return FileStorageContext(directory=dest_dir_path)
 
-        (src_dir_path / "test.txt").write_text("Hello, world")
+    with mock.patch(
+        "semantic_workbench_assistant.assistant_app.FileStorageContext.get",
+        side_effect=file_storage_context_get_mock,
+    ):
+        data_provider = FileStorageConversationDataExporter()
 
-        sub_dir_path = src_dir_path / "subdir"
+        async with data_provider.export(src_conversation_context) as stream:
+            await data_provider.import_(dest_conversation_context, stream)
 
-        sub_dir_path.mkdir()
+        assert (dest_dir_path / "test.txt").read_text() == "Hello, world"
 
-        (sub_dir_path / "test.bin").write_bytes(bytes([1, 2, 3, 4]))
+        assert (dest_dir_path / "subdir" / "test.bin").read_bytes() == bytes([1, 2, 3, 4])
 
-        # export and import
+        assert dest_sub_dir_path.exists() is False
 
-        src_conversation_context = ConversationContext(
-            id=str(uuid.uuid4()),
-            title="My conversation",
-            assistant=AssistantContext(
-                _assistant_service_id="",
-                id=str(uuid.uuid4()),
-                name="my assistant",
-            ),
-        )
 
-        dest_conversation_context = ConversationContext(
-            id=str(uuid.uuid4()),
-            title="My conversation",
-            assistant=AssistantContext(
-                _assistant_service_id="",
-                id=str(uuid.uuid4()),
-                name="my assistant",
-            ),
-        )
+class UnknownErrorForTest(Exception):
+    pass
 
-        def file_storage_context_get_mock(conversation_context: ConversationContext) -> FileStorageContext:
-            if conversation_context == src_conversation_context:
-                return FileStorageContext(directory=src_dir_path)
-            return FileStorageContext(directory=dest_dir_path)
 
-        with mock.patch(
-            "semantic_workbench_assistant.assistant_app.FileStorageContext.get",
-            side_effect=file_storage_context_get_mock,
-        ):
-            data_provider = FileStorageConversationDataExporter()
+def _raise_err_sync(exception: Exception) -> Callable[[], None]:
+    @translate_assistant_errors
+    def raise_err_sync() -> None:
+        raise exception
 
-            async with data_provider.export(src_conversation_context) as stream:
-                await data_provider.import_(dest_conversation_context, stream)
+    return raise_err_sync
 
-            assert (dest_dir_path / "test.txt").read_text() == "Hello, world"
 
-            assert (dest_dir_path / "subdir" / "test.bin").read_bytes() == bytes([1, 2, 3, 4])
+def _raise_err_async(exception: Exception) -> Callable[[], Awaitable[None]]:
+    @translate_assistant_errors
+    async def raise_err_async() -> None:
+        raise exception
 
-            assert dest_sub_dir_path.exists() is False
+    return raise_err_async
 
 
-class UnknownErrorForTest(Exception):
-    pass
+# exception raised, exception expected from the decorated function, and expected status code for HTTPExceptions
+_TRANSLATE_ASSISTANT_ERRORS_CASES: list[tuple[type[Exception], type[Exception], int | None]] = [
+    (UnknownErrorForTest, UnknownErrorForTest, None),
+    (NotFoundError, HTTPException, 404),
+    (ConflictError, HTTPException, 409),
+    (BadRequestError, HTTPException, 400),
+]
 
 
 @pytest.mark.parametrize(
-    "raise_exception,expected_exception,expected_status_code",
+    "raise_err_sync,expected_exception,expected_status_code",
     [
-        [UnknownErrorForTest(), UnknownErrorForTest, None],
-        (NotFoundError(), HTTPException, 404),
-        (ConflictError(), HTTPException, 409),
-        (BadRequestError(), HTTPException, 400),
+        (_raise_err_sync(raise_exception()), expected_exception, expected_status_code)
+        for raise_exception, expected_exception, expected_status_code in _TRANSLATE_ASSISTANT_ERRORS_CASES
     ],
+    ids=[raise_exception.__name__ for raise_exception, _, _ in _TRANSLATE_ASSISTANT_ERRORS_CASES],
 )
-async def test_translate_assistant_errors(
-    raise_exception: Exception, expected_exception: type[Exception], expected_status_code: int | None
+def test_translate_assistant_errors_sync(
+    raise_err_sync: Callable[[], None], expected_exception: type[Exception], expected_status_code: int | None
 ) -> None:
-    @translate_assistant_errors
-    def raise_err_sync() -> None:
-        raise raise_exception
-
-    @translate_assistant_errors
-    async def raise_err_async() -> None:
-        raise raise_exception
-
     with pytest.raises(expected_exception) as exc_info:
         raise_err_sync()
 
     if isinstance(exc_info.value, HTTPException):
         assert exc_info.value.status_code == expected_status_code
 
+
+@pytest.mark.parametrize(
+    "raise_err_async,expected_exception,expected_status_code",
+    [
+        (_raise_err_async(raise_exception()), expected_exception, expected_status_code)
+        for raise_exception, expected_exception, expected_status_code in _TRANSLATE_ASSISTANT_ERRORS_CASES
+    ],
+    ids=[raise_exception.__name__ for raise_exception, _, _ in _TRANSLATE_ASSISTANT_ERRORS_CASES],
+)
+@pytest.mark.asyncio(scope="module")
+async def test_translate_assistant_errors_async(
+    raise_err_async: Callable[[], Awaitable[None]],
+    expected_exception: type[Exception],
+    expected_status_code: int | None,
+) -> None:
     with pytest.raises(expected_exception) as exc_info:
         await raise_err_async()
 